@@ -16,10 +16,27 @@ REQUEST_TIMEOUT = 30
 MAX_RETRIES = 3
 CONCURRENT_REQUESTS = 5
 RATE_LIMIT_DELAY = 1  # seconds between requests
+IMAGE_DOWNLOAD_CONCURRENCY = 10  # in-flight image downloads per batch
+PIPELINE_QUEUE_SIZE = 2  # batches buffered between scrape, embed and insert stages
 
 # Image Processing
+# Checkpoint must be a SigLIP model matching IMAGE_SIZE and EMBEDDING_DIM below
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "google/siglip-base-patch16-384")
 IMAGE_SIZE = (384, 384)  # Required for siglip-base-patch16-384
 EMBEDDING_DIM = 768
+# Images per SigLIP forward pass; 0 = size it from free GPU memory (32 on CPU)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "0"))
+# torch.compile mode for the SigLIP image encoder on GPU
+TORCH_COMPILE_MODE = os.getenv("TORCH_COMPILE_MODE", "reduce-overhead")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+# On-disk HTTP cache for sitemap and product pages (conditional GETs on rerun)
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", "cache/http")
 
 # Database
 TABLE_NAME = "products"
+# Postgres function used for bulk upserts (see README); empty = plain PostgREST upsert
+UPSERT_RPC = os.getenv("UPSERT_RPC", "")
+# gzip batch upsert bodies; only enable if the Supabase gateway accepts Content-Encoding: gzip
+UPSERT_GZIP = os.getenv("UPSERT_GZIP", "false").lower() == "true"
+# Query existing rows before each batch to log "N new / M updated"; costs extra SELECTs per batch
+REPORT_NEW_PRODUCTS = os.getenv("REPORT_NEW_PRODUCTS", "false").lower() == "true"
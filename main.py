@@ -9,14 +9,17 @@ import logging
 import time
 from typing import List, Dict, Any, Optional
 from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 import argparse
 
+import httpx
+
 from scraper.sitemap_parser import SitemapParser
 from scraper.product_scraper import ProductScraper
 from scraper.image_processor import ImageProcessor
-from scraper.supabase_client import SupabaseClient
+from scraper.supabase_client import SupabaseClient, BatchedUpserter
 from scraper.data_mapper import DataMapper
-from config import CONCURRENT_REQUESTS, RATE_LIMIT_DELAY
+from config import CONCURRENT_REQUESTS, IMAGE_DOWNLOAD_CONCURRENCY, PIPELINE_QUEUE_SIZE
 
 # Configure logging
 logging.basicConfig(
@@ -33,74 +36,153 @@ class FootshopScraper:
     """Main orchestrator for the Footshop EU scraping pipeline."""
 
     def __init__(self):
-        self.sitemap_parser = SitemapParser()
-        self.product_scraper = ProductScraper()
-        self.image_processor = ImageProcessor()
         self.supabase_client = SupabaseClient()
         self.data_mapper = DataMapper()
+        # Shared worker pool for blocking HTTP calls, reused across batches
+        self.executor = ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS)
+
+    # Built on first use so modes that don't need them (e.g. stats) skip the setup,
+    # most importantly loading the SigLIP model onto the GPU
+    @cached_property
+    def sitemap_parser(self) -> SitemapParser:
+        return SitemapParser()
+
+    @cached_property
+    def product_scraper(self) -> ProductScraper:
+        return ProductScraper()
+
+    @cached_property
+    def image_processor(self) -> ImageProcessor:
+        return ImageProcessor()
+
+    def close(self):
+        """Release the worker pool."""
+        self.executor.shutdown(wait=True)
 
     async def scrape_product_batch(self, urls: List[str]) -> List[Dict[str, Any]]:
         """Scrape a batch of products asynchronously."""
+        valid_products = await self._scrape_products(urls)
+        async with self.image_processor.create_async_session() as image_session:
+            return await self._embed_products(valid_products, image_session)
+
+    async def _scrape_products(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """Scrape product pages concurrently and return the successfully parsed products."""
         loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
-            # Scrape products
-            logger.info(f"Scraping {len(urls)} products...")
-            product_futures = [
-                loop.run_in_executor(executor, self.product_scraper.scrape_product, url)
-                for url in urls
-            ]
-
-            # Wait for all product scraping to complete
-            raw_products = await asyncio.gather(*product_futures, return_exceptions=True)
-
-            # Filter out exceptions and None results
-            valid_products = [
-                product for product in raw_products
-                if product is not None and not isinstance(product, Exception)
-            ]
-
-            logger.info(f"Successfully scraped {len(valid_products)} products")
-
-            # Process images and generate embeddings
-            processed_products = []
-            for product_data in valid_products:
-                if not product_data:
-                    continue
-
-                # Extract image URLs
-                image_urls = self._extract_image_urls(product_data)
-                logger.debug(f"Extracted {len(image_urls)} image URLs for product: {product_data.get('name', 'Unknown')}")
-                if not image_urls:
-                    logger.warning(f"No image URLs found in product data keys: {list(product_data.keys())}")
-                    # Let's see what image-related fields exist
-                    image_fields = ['image', 'images', 'gallery', 'gallery_images', 'photos', 'pictures']
-                    for field in image_fields:
-                        if field in product_data and product_data[field]:
-                            logger.warning(f"Found {field}: {product_data[field]}")
-
-                try:
-                    # Process images and generate SigLIP embedding (REQUIRED)
-                    image_url, embedding = self.image_processor.process_product_images(image_urls)
-
-                    # Map data to database schema
-                    mapped_product = self.data_mapper.map_product_data(
-                        product_data, image_url, embedding
-                    )
-
-                    processed_products.append(mapped_product)
-                except RuntimeError as e:
-                    logger.error(f"CRITICAL: Failed to generate embedding for product {product_data.get('name', 'Unknown')}: {e}")
-                    logger.error("Skipping product - embeddings are mandatory")
-                    continue
-
-                # Rate limiting
-                await asyncio.sleep(RATE_LIMIT_DELAY)
-
-            return processed_products
+        # Scrape products
+        logger.info(f"Scraping {len(urls)} products...")
+        product_futures = [
+            loop.run_in_executor(self.executor, self.product_scraper.scrape_product, url)
+            for url in urls
+        ]
+
+        # Wait for all product scraping to complete
+        raw_products = await asyncio.gather(*product_futures, return_exceptions=True)
+
+        # Filter out exceptions and None results
+        valid_products = [
+            product for product in raw_products
+            if product is not None and not isinstance(product, Exception)
+        ]
+
+        logger.info(f"Successfully scraped {len(valid_products)} products")
+        return valid_products
+
+    async def _embed_products(self, valid_products: List[Dict[str, Any]],
+                              image_session: httpx.AsyncClient) -> List[Dict[str, Any]]:
+        """Download images, generate SigLIP embeddings and map products to the database schema.
+
+        image_session is the async image client, shared across batches so its HTTP/2
+        connections are reused.
+        """
+        # Download the first available image for every product concurrently
+        semaphore = asyncio.Semaphore(IMAGE_DOWNLOAD_CONCURRENCY)
+
+        async def download(image_urls: List[str]):
+            async with semaphore:
+                return await self.image_processor.download_first_image_async(image_session, image_urls)
+
+        product_image_urls = []
+        for product_data in valid_products:
+            # Extract image URLs
+            image_urls = self._extract_image_urls(product_data)
+            product_image_urls.append(image_urls)
+            logger.debug(f"Extracted {len(image_urls)} image URLs for product: {product_data.get('name', 'Unknown')}")
+            if not image_urls:
+                logger.warning(f"No image URLs found in product data keys: {list(product_data.keys())}")
+                # Let's see what image-related fields exist
+                image_fields = ['image', 'images', 'gallery', 'gallery_images', 'photos', 'pictures']
+                for field in image_fields:
+                    if field in product_data and product_data[field]:
+                        logger.warning(f"Found {field}: {product_data[field]}")
+
+        # Reuse the embedding of the product's own first image; later candidates may
+        # belong to other colourways and are only used if that image can't be fetched.
+        # The cache is SQLite behind a lock, so the lookups run off the event loop
+        cached = iter(await asyncio.to_thread(
+            self.image_processor.get_cached_embeddings,
+            [image_urls[0] for image_urls in product_image_urls if image_urls]
+        ))
+
+        image_tasks = []
+        to_download = []
+        cached_products = []
+        for product_data, image_urls in zip(valid_products, product_image_urls):
+            embedding = next(cached) if image_urls else None
+            if embedding is not None:
+                cached_products.append((product_data, image_urls[0], embedding))
+                continue
+
+            to_download.append(product_data)
+            image_tasks.append(download(image_urls))
+
+        downloads = await asyncio.gather(*image_tasks, return_exceptions=True)
+
+        # Collect (product_data, image_url, image) for products with a usable image
+        downloaded = []
+        for product_data, result in zip(to_download, downloads):
+            if result is None or isinstance(result, Exception):
+                logger.error(f"CRITICAL: No image could be downloaded for product {product_data.get('name', 'Unknown')}")
+                logger.error("Skipping product - embeddings are mandatory")
+                continue
+            image_url, image = result
+            downloaded.append((product_data, image_url, image))
+
+        embedded = list(cached_products)
+        if downloaded:
+            # Generate SigLIP embeddings for the whole batch in one forward pass (REQUIRED)
+            try:
+                # Off the event loop so scraping and inserts keep running during the forward pass
+                embeddings = await self.image_processor.generate_embeddings_batch_async(
+                    [image for _, _, image in downloaded]
+                )
+                await asyncio.to_thread(
+                    self.image_processor.cache_embeddings,
+                    [(image_url, embedding) for (_, image_url, _), embedding in zip(downloaded, embeddings)]
+                )
+                embedded.extend(
+                    (product_data, image_url, embedding)
+                    for (product_data, image_url, _), embedding in zip(downloaded, embeddings)
+                )
+            except RuntimeError as e:
+                logger.error(f"CRITICAL: Failed to generate embeddings for batch of {len(downloaded)} products: {e}")
+                logger.error("Skipping downloaded products - embeddings are mandatory")
+
+        logger.info(f"Embeddings ready for {len(embedded)} products ({len(cached_products)} from cache)")
+
+        processed_products = []
+        for product_data, image_url, embedding in embedded:
+            # Map data to database schema
+            mapped_product = self.data_mapper.map_product_data(
+                product_data, image_url, embedding
+            )
+            processed_products.append(mapped_product)
+
+        return processed_products
 
     def _extract_image_urls(self, product_data: Dict[str, Any]) -> List[str]:
         """Extract all available image URLs from product data."""
-        image_urls = []
+        # Insertion-ordered dict used as an ordered set for O(1) de-duplication
+        image_urls: Dict[str, None] = {}
 
         # Handle Footshop's specific image structure
         images_data = product_data.get('images')
@@ -108,7 +190,7 @@ class FootshopScraper:
             # Add cover image
             cover_image = images_data.get('cover_image')
             if cover_image:
-                image_urls.append(cover_image)
+                image_urls[cover_image] = None
 
             # Add images from 'other' array
             other_images = images_data.get('other', [])
@@ -117,20 +199,20 @@ class FootshopScraper:
                     if isinstance(img_obj, dict):
                         # Prefer mobile_image for full resolution, fallback to image
                         img_url = img_obj.get('mobile_image') or img_obj.get('image')
-                        if img_url and img_url not in image_urls:
-                            image_urls.append(img_url)
+                        if img_url:
+                            image_urls.setdefault(img_url, None)
 
         # Try other image fields as fallback
         image_fields = ['gallery_images', 'product_images']
         for field in image_fields:
             images = product_data.get(field, [])
             if images and isinstance(images, list):
-                image_urls.extend(images)
+                image_urls.update(dict.fromkeys(url for url in images if url))
 
         # Add main image if not already included
         main_image = product_data.get('image') or product_data.get('last_image')
         if main_image and main_image not in image_urls:
-            image_urls.insert(0, main_image)
+            image_urls = {main_image: None, **image_urls}
 
         # Check variants for additional images
         variants = product_data.get('variants') or product_data.get('color_variations', [])
@@ -140,24 +222,19 @@ class FootshopScraper:
                     variant_images = variant.get('images') or variant.get('image')
                     if variant_images:
                         if isinstance(variant_images, list):
-                            image_urls.extend(variant_images)
+                            image_urls.update(dict.fromkeys(url for url in variant_images if url))
                         elif isinstance(variant_images, str):
-                            image_urls.append(variant_images)
-
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_urls = []
-        for url in image_urls:
-            if url and url not in seen:
-                seen.add(url)
-                unique_urls.append(url)
+                            image_urls.setdefault(variant_images, None)
 
-        return unique_urls
+        return list(image_urls)
 
-    async def scrape_all_products(self, batch_size: int = 10, limit: Optional[int] = None) -> int:
+    async def scrape_all_products(self, batch_size: int = 200, limit: Optional[int] = None) -> int:
         """Scrape all products from Footshop EU."""
         logger.info("Starting full Footshop EU scrape")
 
+        # Load SigLIP before scraping anything - embeddings are mandatory
+        self.image_processor
+
         # Get all product URLs from sitemap
         try:
             all_urls = self.sitemap_parser.get_product_urls()
@@ -169,29 +246,60 @@ class FootshopScraper:
 
         logger.info(f"Found {len(all_urls)} products to scrape")
 
+        total_batches = (len(all_urls) + batch_size - 1) // batch_size
         total_processed = 0
 
-        # Process in batches
-        for i in range(0, len(all_urls), batch_size):
-            batch_urls = all_urls[i:i + batch_size]
-            logger.info(f"Processing batch {i//batch_size + 1}/{(len(all_urls) + batch_size - 1)//batch_size}")
+        # scrape -> embed -> insert run as concurrent stages; bounded queues provide backpressure
+        scraped_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        insert_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
 
+        async def producer():
             try:
-                # Scrape batch
-                processed_products = await self.scrape_product_batch(batch_urls)
-
-                # Insert into database
-                if processed_products:
-                    successful_inserts = self.supabase_client.insert_products_batch(processed_products)
-                    total_processed += successful_inserts
-                    logger.info(f"Batch completed: {successful_inserts}/{len(processed_products)} products inserted")
-
-                # Small delay between batches
-                await asyncio.sleep(1)
+                for batch_number, i in enumerate(range(0, len(all_urls), batch_size), start=1):
+                    logger.info(f"Scraping batch {batch_number}/{total_batches}")
+                    try:
+                        products = await self._scrape_products(all_urls[i:i + batch_size])
+                    except Exception as e:
+                        logger.error(f"Error scraping batch {batch_number}: {e}")
+                        continue
+                    if products:
+                        await scraped_queue.put((batch_number, products))
+            finally:
+                await scraped_queue.put(None)
+
+        async def embedder(image_session: httpx.AsyncClient):
+            try:
+                while (item := await scraped_queue.get()) is not None:
+                    batch_number, products = item
+                    try:
+                        processed_products = await self._embed_products(products, image_session)
+                    except Exception as e:
+                        logger.error(f"Error embedding batch {batch_number}: {e}")
+                        continue
+                    if processed_products:
+                        await insert_queue.put((batch_number, processed_products))
+            finally:
+                await insert_queue.put(None)
+
+        async def writer():
+            nonlocal total_processed
+            # Rows from consecutive scrape batches are coalesced into larger upserts
+            upserter = BatchedUpserter(self.supabase_client)
+            try:
+                while (item := await insert_queue.get()) is not None:
+                    batch_number, processed_products = item
+                    for product in processed_products:
+                        await upserter.push(product)
+                    logger.info(f"Batch {batch_number} completed: {len(processed_products)} products queued for insert")
+            finally:
+                total_processed = await upserter.close()
 
-            except Exception as e:
-                logger.error(f"Error processing batch {i//batch_size + 1}: {e}")
-                continue
+        try:
+            # One image client for the whole run so HTTP/2 connections to the CDN stay open
+            async with self.image_processor.create_async_session() as image_session:
+                await asyncio.gather(producer(), embedder(image_session), writer())
+        finally:
+            await self.supabase_client.aclose()
 
         logger.info(f"Scraping completed. Total products processed: {total_processed}")
         return total_processed
@@ -238,39 +346,42 @@ class FootshopScraper:
             'footshop_products': footshop_products
         }
 
-async def main():
+async def main(argv: Optional[List[str]] = None):
+    """Command-line entry point; pass argv to run it in-process (e.g. from a test script)."""
     parser = argparse.ArgumentParser(description='Footshop EU Product Scraper')
     parser.add_argument('--mode', choices=['full', 'single', 'stats'],
                        default='stats', help='Scraping mode')
     parser.add_argument('--url', help='Single product URL for single mode')
-    parser.add_argument('--batch-size', type=int, default=5,
+    parser.add_argument('--batch-size', type=int, default=200,
                        help='Batch size for full scraping')
     parser.add_argument('--limit', type=int,
                        help='Limit number of products to scrape')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     scraper = FootshopScraper()
-
-    if args.mode == 'full':
-        total_processed = await scraper.scrape_all_products(
-            batch_size=args.batch_size,
-            limit=args.limit
-        )
-        print(f"Scraping completed. Processed {total_processed} products.")
-
-    elif args.mode == 'single':
-        if not args.url:
-            print("Error: --url is required for single mode")
-            return
-        success = await scraper.scrape_single_product(args.url)
-        print(f"Single product scraping {'successful' if success else 'failed'}")
-
-    elif args.mode == 'stats':
-        stats = scraper.get_scraping_stats()
-        print("Scraping Statistics:")
-        print(f"Total products in database: {stats['total_products_in_db']}")
-        print(f"Footshop EU products: {stats['footshop_products']}")
+    try:
+        if args.mode == 'full':
+            total_processed = await scraper.scrape_all_products(
+                batch_size=args.batch_size,
+                limit=args.limit
+            )
+            print(f"Scraping completed. Processed {total_processed} products.")
+
+        elif args.mode == 'single':
+            if not args.url:
+                print("Error: --url is required for single mode")
+                return
+            success = await scraper.scrape_single_product(args.url)
+            print(f"Single product scraping {'successful' if success else 'failed'}")
+
+        elif args.mode == 'stats':
+            stats = scraper.get_scraping_stats()
+            print("Scraping Statistics:")
+            print(f"Total products in database: {stats['total_products_in_db']}")
+            print(f"Footshop EU products: {stats['footshop_products']}")
+    finally:
+        scraper.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
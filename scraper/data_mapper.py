@@ -1,19 +1,27 @@
 from typing import Dict, Any, List, Optional
-import json
+import orjson
+from hashlib import blake2b
+import numpy as np
 from datetime import datetime
+from scraper.utils import compress_ftshp_url
+from scraper.embedding_cache import to_fp16_bytes
+from config import UPSERT_RPC
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Columns that vary between runs without the product changing, left out of content_hash
+_UNHASHED_FIELDS = ('created_at', 'embedding', 'search_vector', 'search_tsv')
+
 class DataMapper:
     """Maps scraped product data to database schema."""
 
     def map_product_data(self, raw_data: Dict[str, Any], image_url: str,
-                        embedding: List[float]) -> Dict[str, Any]:
+                        embedding: np.ndarray) -> Dict[str, Any]:
         """Map raw scraped data to database schema."""
 
         # Validate required parameters
-        if not embedding:
+        if embedding is None or len(embedding) == 0:
             raise ValueError("Embedding is required - cannot map product data without SigLIP embedding")
 
         if len(embedding) != 768:
@@ -25,18 +33,24 @@ class DataMapper:
         # Generate unique ID
         product_id = self._generate_product_id(raw_data)
 
+        # Extract fields that are reused across several columns once
+        main_image = image_url or self._extract_main_image(raw_data)
+        brand = self._extract_brand(raw_data)
+        category = self._extract_category(raw_data)
+        gender = self._extract_gender(raw_data)
+
         # Extract basic information
         mapped_data = {
             'id': product_id,
             'source': raw_data.get('source', 'footshop_eu'),
             'product_url': raw_data.get('product_url'),
             'affiliate_url': None,  # Footshop doesn't provide affiliate URLs
-            'image_url': image_url or self._extract_main_image(raw_data),
-            'brand': self._extract_brand(raw_data),
+            'image_url': main_image,
+            'brand': brand,
             'title': self._extract_title(raw_data),
             'description': self._extract_description(raw_data),
-            'category': self._extract_category(raw_data),
-            'gender': self._extract_gender(raw_data),
+            'category': category,
+            'gender': gender,
             'price': self._extract_price(raw_data),
             'currency': self._extract_currency(raw_data),
             'created_at': datetime.now().isoformat(),
@@ -45,14 +59,26 @@ class DataMapper:
             'second_hand': False,  # Footshop is primarily new items
             'embedding': embedding,
             'country': raw_data.get('country', 'EU'),
-            'compressed_image_url': self._create_compressed_image_url(image_url or self._extract_main_image(raw_data)),
-            'tags': self._extract_tags(raw_data),
+            'compressed_image_url': compress_ftshp_url(main_image),
+            'tags': self._extract_tags(raw_data, brand, category, gender),
             'search_vector': None,  # Will be computed by PostgreSQL
             'search_tsv': None  # Will be computed by PostgreSQL
         }
+        # Only the upsert_products function compares it; the plain upsert would just
+        # need the extra column without ever skipping a write
+        if UPSERT_RPC:
+            mapped_data['content_hash'] = self._content_hash(mapped_data)
 
         return mapped_data
 
+    def _content_hash(self, mapped_data: Dict[str, Any]) -> str:
+        """Stable hash of the stored product content, so unchanged rows can skip their update."""
+        content = {key: value for key, value in mapped_data.items() if key not in _UNHASHED_FIELDS}
+        digest = blake2b(orjson.dumps(content, option=orjson.OPT_SORT_KEYS), digest_size=16)
+        # Hashed at cache precision so a freshly computed and a cached embedding hash the same
+        digest.update(to_fp16_bytes(mapped_data['embedding']))
+        return digest.hexdigest()
+
     def _generate_product_id(self, raw_data: Dict[str, Any]) -> str:
         """Generate a unique product ID."""
         # Use the product's internal ID if available, otherwise create from URL
@@ -62,9 +88,8 @@ class DataMapper:
             return f"footshop_eu_{product_id}"
         else:
             # Fallback: hash the product URL
-            import hashlib
             url = raw_data.get('product_url', '')
-            return f"footshop_eu_{hashlib.md5(url.encode()).hexdigest()[:16]}"
+            return f"footshop_eu_{blake2b(url.encode(), digest_size=8).hexdigest()}"
 
     def _extract_main_image(self, raw_data: Dict[str, Any]) -> Optional[str]:
         """Extract the main product image URL."""
@@ -188,43 +213,28 @@ class DataMapper:
 
         if metadata:
             try:
-                return json.dumps(metadata, ensure_ascii=False)
+                # orjson emits UTF-8 without ASCII escaping, like ensure_ascii=False
+                return orjson.dumps(metadata).decode()
             except Exception as e:
                 logger.warning(f"Failed to serialize metadata: {e}")
                 return None
 
         return None
 
-    def _create_compressed_image_url(self, image_url: Optional[str]) -> Optional[str]:
-        """Create a compressed version of the image URL."""
-        if not image_url:
-            return None
-
-        # Footshop uses static.ftshp.digital for images
-        # Try to create a smaller version
-        if 'static.ftshp.digital' in image_url:
-            # Replace with smaller size if available
-            compressed_url = image_url.replace('full_product', 'medium_product')
-            return compressed_url
-
-        return image_url
-
-    def _extract_tags(self, raw_data: Dict[str, Any]) -> Optional[List[str]]:
-        """Extract tags for the product."""
+    def _extract_tags(self, raw_data: Dict[str, Any], brand: Optional[str],
+                      category: Optional[str], gender: Optional[str]) -> Optional[List[str]]:
+        """Extract tags for the product from already-extracted brand/category/gender."""
         tags = []
 
         # Add brand as tag
-        brand = self._extract_brand(raw_data)
         if brand:
             tags.append(brand.lower().replace(' ', '_'))
 
         # Add category as tag
-        category = self._extract_category(raw_data)
         if category:
             tags.append(category.lower().replace(' ', '_'))
 
         # Add gender as tag
-        gender = self._extract_gender(raw_data)
         if gender:
             tags.append(f"gender_{gender}")
 
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import Iterable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Recently used embeddings kept in RAM in front of SQLite (~3 KB each as float32)
+MEMORY_CACHE_SIZE = 4096
+
+def to_fp16_bytes(embedding: np.ndarray) -> bytes:
+    """Pack an embedding as raw float16 bytes (1.5 KB for 768 dims) for compact storage."""
+    return np.asarray(embedding, dtype=np.float16).tobytes()
+
+def from_fp16_bytes(data: bytes) -> np.ndarray:
+    """Inverse of to_fp16_bytes; returns a float32 array."""
+    return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by image URL: an in-memory LRU over SQLite."""
+
+    def __init__(self, path: str, memory_size: int = MEMORY_CACHE_SIZE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_size = memory_size
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"Using embedding cache: {path}")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached embedding for a key, or None on a miss."""
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                return embedding
+
+            row = self._conn.execute(
+                "SELECT embedding FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            # Stored as float16 to halve the cache size
+            embedding = from_fp16_bytes(row[0])
+            self._remember(key, embedding)
+            return embedding
+
+    def _remember(self, key: str, embedding: np.ndarray):
+        """Put an embedding in the in-memory tier, evicting the least recently used. Caller holds the lock."""
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def set(self, key: str, embedding: np.ndarray):
+        """Store a single embedding."""
+        self.set_many([(key, embedding)])
+
+    def set_many(self, items: Iterable[Tuple[str, np.ndarray]]):
+        """Store several embeddings in one transaction."""
+        rows = [(key, to_fp16_bytes(embedding)) for key, embedding in items]
+        if not rows:
+            return
+
+        with self._lock:
+            for key, blob in rows:
+                # Same float16 round-trip as a SQLite hit, so both tiers return identical values
+                self._remember(key, from_fp16_bytes(blob))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)", rows
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -1,39 +1,86 @@
-import requests
+import httpx
+import numpy as np
 import torch
 from PIL import Image
-from transformers import AutoProcessor, AutoModel
-from typing import List, Optional, Tuple
+from transformers import AutoImageProcessor, AutoModel
+from typing import Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import io
 import os
-import hashlib
-from config import IMAGE_SIZE, EMBEDDING_DIM, REQUEST_TIMEOUT
-from scraper.utils import retry_on_failure, RateLimiter
+from config import (
+    IMAGE_SIZE, EMBEDDING_DIM, EMBEDDING_BATCH_SIZE, REQUEST_TIMEOUT, EMBEDDING_CACHE_PATH,
+    TORCH_COMPILE_MODE, IMAGE_DOWNLOAD_CONCURRENCY, EMBEDDING_MODEL,
+)
+from scraper.embedding_cache import EmbeddingCache
+from scraper.utils import retry_on_failure, compress_ftshp_url, RETRYABLE_EXCEPTIONS
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Rough inference-time activation footprint of one 384x384 image in SigLIP-base
+EMBEDDING_MEMORY_PER_IMAGE = 64 * 1024 ** 2
+CPU_EMBEDDING_BATCH_SIZE = 32
+# Candidate images of one product fetched concurrently by the sync download path
+DOWNLOAD_WINDOW = 4
+MAX_EMBEDDING_BATCH_SIZE = 256
+# Smallest padded forward on CUDA; buckets double from here up to the batch size, which
+# keeps the number of compiled shapes (8..256 -> 6) under dynamo's recompile limit
+MIN_EMBEDDING_BUCKET = 8
+# Pillow reduces by an integer factor first while keeping at least this much headroom
+# over the target size before the final bicubic pass
+RESIZE_REDUCING_GAP = 3.0
+
+# All images come from one CDN host; over HTTP/2 these connections multiplex many requests
+IMAGE_CONNECTION_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+# Minimal headers for image downloads
+IMAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; ProductScraper/1.0)',
+    'Accept': 'image/*,*/*;q=0.8',
+    'Referer': 'https://www.footshop.eu/',
+}
+
 class ImageProcessor:
     """Handles image downloading and embedding generation using SigLIP."""
 
     def __init__(self):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         logger.info(f"Using device: {self.device}")
-        self.rate_limiter = RateLimiter(requests_per_second=2.0)  # Higher rate for images
+
+        # HTTP/2 client for the image CDN; concurrency is bounded by the connection limits
+        # and the download pool rather than a global requests-per-second limit
+        self.client = httpx.Client(**self._client_options())
+        self.download_executor = ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_CONCURRENCY)
+
+        # Embeddings of already-seen images are reused across products and runs
+        self.cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
 
         # Initialize SigLIP model - REQUIRED for embeddings
-        model_name = "google/siglip-base-patch16-384"
+        model_name = EMBEDDING_MODEL
 
         try:
             logger.info(f"Loading SigLIP model: {model_name}")
 
-            # Use AutoProcessor to get the full SigLIP processor (handles both image and text)
-            self.processor = AutoProcessor.from_pretrained(model_name)
-            logger.info("Using SigLIP processor (handles both image and text)")
+            # Only the image processor config (mean/std) is needed; preprocessing itself runs as
+            # a tensor pipeline below, and skipping the tokenizer avoids loading sentencepiece
+            self.processor = AutoImageProcessor.from_pretrained(model_name)
+            logger.info("Using SigLIP image processor config for on-device normalisation")
 
             self.model = AutoModel.from_pretrained(model_name)
             self.model.to(self.device)
             self.model.eval()
             self.model_type = "SigLIP"
+
+            # Half precision on GPU uses tensor cores and halves weight/activation bandwidth
+            self.dtype = self._select_dtype()
+            self.model.to(self.dtype)
+            logger.info(f"SigLIP running in {self.dtype}")
+            self._image_features = self.model.get_image_features
+
+            # Normalisation constants kept on the device so it runs once per batch after transfer
+            self.mean = torch.tensor(self.processor.image_mean, device=self.device, dtype=self.dtype).view(1, 3, 1, 1)
+            self.std = torch.tensor(self.processor.image_std, device=self.device, dtype=self.dtype).view(1, 3, 1, 1)
             logger.info("SigLIP model loaded successfully - embeddings will be generated")
 
         except Exception as e:
@@ -41,80 +88,366 @@ class ImageProcessor:
             logger.error("Embeddings are REQUIRED - scraper cannot continue without SigLIP")
             raise RuntimeError(f"SigLIP model loading failed: {e}. Embeddings are mandatory for this scraper.")
 
-    @retry_on_failure(max_attempts=3)
-    def download_image(self, image_url: str) -> Optional[Image.Image]:
-        """Download image from URL and return PIL Image."""
+        # Every forward runs on this one thread: cudagraph trees keep per-thread state, so
+        # graphs recorded during warm-up only replay for calls made from the same thread
+        self.embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="siglip")
+
+        self.batch_size = self._choose_batch_size()
+        logger.info(f"SigLIP batch size: {self.batch_size}")
+
+        if self.device.type == "cuda":
+            self._init_transfer_buffers()
+            self._compile_model()
+
+    def _select_dtype(self) -> torch.dtype:
+        """bfloat16 on GPUs that support it (Ampere+), float16 on older GPUs, float32 on CPU."""
+        if self.device.type != "cuda":
+            return torch.float32
+
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+    def _choose_batch_size(self) -> int:
+        """Use EMBEDDING_BATCH_SIZE if set, otherwise fit the batch into half of the free GPU memory."""
+        if EMBEDDING_BATCH_SIZE > 0:
+            return EMBEDDING_BATCH_SIZE
+
+        if self.device.type != "cuda":
+            return CPU_EMBEDDING_BATCH_SIZE
+
+        free_bytes, _ = torch.cuda.mem_get_info(self.device)
+        return max(1, min(MAX_EMBEDDING_BATCH_SIZE, (free_bytes // 2) // EMBEDDING_MEMORY_PER_IMAGE))
+
+    def _init_transfer_buffers(self):
+        """Allocate pinned staging, persistent device buffers and a side stream for H2D copies."""
+        shape = (self.batch_size, 3, IMAGE_SIZE[1], IMAGE_SIZE[0])
+        # Double-buffered host staging so the next chunk can be filled while the last one copies
+        self._pinned = [torch.empty(shape, dtype=torch.uint8, pin_memory=True) for _ in range(2)]
+        self._copy_done = [None, None]
+        self._copy_stream = torch.cuda.Stream()
+
+        # Every forward reads a prefix of the same input tensor, so each bucket's CUDA graph replays
+        self._device_buf = torch.empty(shape, dtype=torch.uint8, device=self.device)
+        self._device_buf_free = None
+        self._pixel_buf = torch.zeros(shape, dtype=self.dtype, device=self.device)
+
+    def _to_pixel_values(self, batch: torch.Tensor, slot: int, padded: bool = True) -> torch.Tensor:
+        """Turn a uint8 CPU batch into normalised pixel values on the model device.
+
+        With padded on CUDA this returns a prefix of the persistent buffer padded to the
+        batch's bucket size; only the first len(batch) rows are meaningful. Otherwise the
+        result has len(batch) rows.
+        """
+        if self.device.type != "cuda" or not padded:
+            return batch.to(self.device).to(self.dtype).div_(255).sub_(self.mean).div_(self.std)
+
+        n = batch.shape[0]
+
+        # The staging slot is reused every other chunk; wait until its last copy has finished
+        if self._copy_done[slot] is not None:
+            self._copy_done[slot].synchronize()
+
+        staging = self._pinned[slot][:n]
+        staging.copy_(batch)
+
+        with torch.cuda.stream(self._copy_stream):
+            # Don't overwrite the device buffer before the previous chunk has been normalised
+            if self._device_buf_free is not None:
+                self._copy_stream.wait_event(self._device_buf_free)
+            self._device_buf[:n].copy_(staging, non_blocking=True)
+            self._copy_done[slot] = torch.cuda.Event()
+            self._copy_done[slot].record(self._copy_stream)
+
+        torch.cuda.current_stream().wait_stream(self._copy_stream)
+
+        # uint8 pixels are rescaled/normalised on the device, in place
+        self._pixel_buf[:n].copy_(self._device_buf[:n])
+        self._device_buf_free = torch.cuda.Event()
+        self._device_buf_free.record(torch.cuda.current_stream())
+        self._pixel_buf[:n].div_(255).sub_(self.mean).div_(self.std)
+        return self._pixel_buf[:self._bucket_size(n)]
+
+    def _bucket_size(self, n: int) -> int:
+        """Padded row count for a batch of n: the next power of two, within [MIN_EMBEDDING_BUCKET, batch_size]."""
+        return min(self.batch_size, max(MIN_EMBEDDING_BUCKET, 1 << (n - 1).bit_length()))
+
+    def _compile_model(self):
+        """Compile the SigLIP image encoder and trigger compilation with a warmup forward."""
         try:
-            logger.debug(f"Downloading image: {image_url}")
-            self.rate_limiter.wait_if_needed_sync()
+            logger.info(f"Compiling SigLIP image encoder with torch.compile (mode={TORCH_COMPILE_MODE})")
+            # Inputs come in a handful of bucket shapes, each compiled (and graphed) on first use
+            compiled = torch.compile(
+                self.model.get_image_features, mode=TORCH_COMPILE_MODE, fullgraph=False, dynamic=False
+            )
+
+            # Warm up the full-batch shape, the one the pipeline uses most; the second run
+            # records the CUDA graph that later calls (on the same thread) replay
+            self.embed_executor.submit(self._warm_up, compiled).result()
+
+            self._image_features = compiled
+            logger.info("SigLIP image encoder compiled")
+
+        except Exception as e:
+            logger.warning(f"torch.compile failed, using eager SigLIP forward: {e}")
+
+    def _warm_up(self, compiled):
+        """Run the compiled encoder twice on the persistent buffer; called on the embedding thread."""
+        with torch.inference_mode():
+            for _ in range(2):
+                compiled(pixel_values=self._pixel_buf)
+        torch.cuda.synchronize(self.device)
+
+    def _client_options(self) -> dict:
+        """Settings shared by the sync and async image clients."""
+        return dict(
+            http2=True,
+            limits=IMAGE_CONNECTION_LIMITS,
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+            headers=IMAGE_HEADERS,
+        )
 
-            # Minimal headers for image downloads
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; ProductScraper/1.0)',
-                'Accept': 'image/*,*/*;q=0.8',
-                'Referer': 'https://www.footshop.eu/',
-            }
+    def _image_variants(self, image_url: str) -> List[str]:
+        """URLs to try for an image: the medium CDN variant first, then the original.
 
-            response = requests.get(image_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+        The model input is 384x384, so medium_product loses nothing after resizing
+        but is a fraction of the full_product bytes to transfer and decode.
+        """
+        compressed = self.create_compressed_image_url(image_url)
+        if compressed and compressed != image_url:
+            return [compressed, image_url]
+        return [image_url]
+
+    @staticmethod
+    def _is_usable(response: httpx.Response) -> bool:
+        """Whether a response has an image body worth decoding."""
+        return response.is_success and len(response.content) > 0
+
+    def _image_content(self, image_url: str, response: httpx.Response) -> Optional[bytes]:
+        """Body of the chosen variant's response.
+
+        Server errors and 429 raise so the download is retried; a missing or empty image gives None.
+        """
+        if response.is_server_error or response.status_code == 429:
             response.raise_for_status()
+        if not self._is_usable(response):
+            logger.warning(f"Failed to download image {image_url}: HTTP {response.status_code}")
+            return None
+        return response.content
 
-            # Convert to PIL Image
-            image = Image.open(io.BytesIO(response.content))
+    def download_image(self, image_url: str) -> Optional[Image.Image]:
+        """Download image from URL and return PIL Image (None on failure)."""
+        try:
+            return self._fetch_image(image_url)
+        except RETRYABLE_EXCEPTIONS as e:
+            logger.warning(f"Failed to download image {image_url}: {e}")
+            return None
 
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+    @retry_on_failure(max_attempts=3)
+    def _fetch_image(self, image_url: str) -> Optional[Image.Image]:
+        """Download and decode an image; transient network errors propagate so they are retried."""
+        logger.debug(f"Downloading image: {image_url}")
 
-            return image
+        error = None
+        for url in self._image_variants(image_url):
+            try:
+                response = self.client.get(url)
+            except httpx.TransportError as e:
+                # A timeout on one variant still leaves the next one to try
+                error = e
+                continue
+            if self._is_usable(response):
+                break
+        else:
+            if error is not None:
+                raise error
 
-        except requests.RequestException as e:
+        content = self._image_content(image_url, response)
+        if content is None:
+            return None
+
+        try:
+            return self._decode_image(content)
+        except Exception as e:
+            logger.warning(f"Failed to process image {image_url}: {e}")
+            return None
+
+    def create_async_session(self) -> httpx.AsyncClient:
+        """Create an HTTP/2 async client for concurrent image downloads."""
+        return httpx.AsyncClient(**self._client_options())
+
+    async def _download_image_async(self, session: httpx.AsyncClient, image_url: str) -> Optional[Image.Image]:
+        """Download image from URL with an async client and return PIL Image (None on failure)."""
+        try:
+            return await self._fetch_image_async(session, image_url)
+        except RETRYABLE_EXCEPTIONS as e:
             logger.warning(f"Failed to download image {image_url}: {e}")
             return None
+
+    @retry_on_failure(max_attempts=3)
+    async def _fetch_image_async(self, session: httpx.AsyncClient, image_url: str) -> Optional[Image.Image]:
+        """Async equivalent of _fetch_image."""
+        logger.debug(f"Downloading image: {image_url}")
+
+        error = None
+        for url in self._image_variants(image_url):
+            try:
+                response = await session.get(url)
+            except httpx.TransportError as e:
+                # A timeout on one variant still leaves the next one to try
+                error = e
+                continue
+            if self._is_usable(response):
+                break
+        else:
+            if error is not None:
+                raise error
+
+        content = self._image_content(image_url, response)
+        if content is None:
+            return None
+
+        try:
+            # Decode + resize are CPU-bound; run them on the worker pool so the event loop
+            # keeps servicing other downloads (Pillow releases the GIL while decoding)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.download_executor, self._decode_image, content)
         except Exception as e:
             logger.warning(f"Failed to process image {image_url}: {e}")
             return None
 
-    def generate_embedding(self, image: Image.Image) -> List[float]:
+    def _decode_image(self, content: bytes) -> Image.Image:
+        """Decode downloaded bytes into an RGB PIL Image."""
+        image = Image.open(io.BytesIO(content))
+
+        # JPEGs much larger than the model input are decoded at a reduced DCT
+        # scale by libjpeg (never below IMAGE_SIZE); no-op for other formats
+        image.draft('RGB', IMAGE_SIZE)
+
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        # Resize here, on the download worker, so the embedding thread only stacks tensors.
+        # reducing_gap box-reduces large images first, far cheaper than a full bicubic pass
+        if image.size != IMAGE_SIZE:
+            image = image.resize(IMAGE_SIZE, Image.Resampling.BICUBIC, reducing_gap=RESIZE_REDUCING_GAP)
+
+        return image
+
+    def _to_tensor(self, image: Image.Image) -> torch.Tensor:
+        """Resize an RGB image to the SigLIP input size and return it as a uint8 CHW tensor."""
+        if image.size != IMAGE_SIZE:
+            # Downloaded images are already resized; this only covers images passed in directly
+            image = image.resize(IMAGE_SIZE, Image.Resampling.BICUBIC)
+
+        return torch.from_numpy(np.array(image)).permute(2, 0, 1)
+
+    def generate_embedding(self, image: Image.Image) -> np.ndarray:
         """Generate 768-dimensional SigLIP embedding for an image. REQUIRED - no fallbacks."""
+        # A one-off image runs eagerly on a batch of one rather than as a full padded
+        # forward over the persistent buffer, which is sized for the batched pipeline
+        return self.embed_executor.submit(self._generate_embeddings, [image], False).result()[0]
+
+    def generate_embeddings_batch(self, images: List[Image.Image]) -> List[np.ndarray]:
+        """Generate SigLIP embeddings for a list of images in a single forward pass."""
+        return self.embed_executor.submit(self._generate_embeddings, images).result()
+
+    async def generate_embeddings_batch_async(self, images: List[Image.Image]) -> List[np.ndarray]:
+        """Awaitable generate_embeddings_batch; the event loop keeps running during the forward pass."""
+        return await asyncio.wrap_future(self.embed_executor.submit(self._generate_embeddings, images))
+
+    def _generate_embeddings(self, images: List[Image.Image], padded: bool = True) -> List[np.ndarray]:
+        """Embed images; runs on the embedding thread.
+
+        padded uses the persistent buffer and the compiled encoder; otherwise the
+        eager encoder runs on exactly len(images) rows.
+        """
         if self.model is None or self.processor is None:
             raise RuntimeError("SigLIP model not loaded - embeddings are mandatory")
 
         if self.model_type != "SigLIP":
             raise RuntimeError("Only SigLIP embeddings are supported - no fallbacks allowed")
 
+        if not images:
+            return []
+
+        image_features = self._image_features if padded else self.model.get_image_features
+
         try:
-            # Preprocess image - SigLIP requires both image and text inputs
-            # For image-only embeddings, we provide an empty text
-            inputs = self.processor(
-                images=image,
-                text=[""],  # Empty text input for image-only processing
-                return_tensors="pt",
-                padding=True
-            )
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            outputs = []
+            # Preprocessing, forward and normalisation all skip autograd bookkeeping
+            with torch.inference_mode():
+                for slot, start in enumerate(range(0, len(images), self.batch_size)):
+                    # CPU preprocessing of this chunk overlaps the previous chunk's forward on GPU
+                    batch = torch.stack([self._to_tensor(image) for image in images[start:start + self.batch_size]])
+                    pixel_values = self._to_pixel_values(batch, slot % 2, padded)
 
-            # Generate SigLIP embedding
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                # For SigLIP, use image_embeds for image-only embeddings
-                embedding = outputs.image_embeds.squeeze().cpu().numpy()
+                    # Padding rows of the persistent buffer are dropped here
+                    image_embeds = image_features(pixel_values=pixel_values)[:len(batch)].float()
+                    # Same L2 normalisation SiglipModel applies to image_embeds
+                    outputs.append(torch.nn.functional.normalize(image_embeds, p=2, dim=-1))
 
-            # Ensure we have a 1D array
-            if embedding.ndim > 1:
-                embedding = embedding.flatten()
+                # Single device-to-host sync for the whole batch
+                embeddings = torch.cat(outputs).cpu().numpy()
 
             # Verify correct dimension (768 for siglip-base-patch16-384)
-            if len(embedding) != EMBEDDING_DIM:
-                raise ValueError(f"SigLIP embedding dimension mismatch: got {len(embedding)}, expected {EMBEDDING_DIM}")
+            if embeddings.shape[-1] != EMBEDDING_DIM:
+                raise ValueError(f"SigLIP embedding dimension mismatch: got {embeddings.shape[-1]}, expected {EMBEDDING_DIM}")
 
-            logger.debug(f"Generated SigLIP embedding with {len(embedding)} dimensions")
-            return embedding.tolist()
+            logger.debug(f"Generated {len(embeddings)} SigLIP embeddings with {embeddings.shape[-1]} dimensions")
+            # One float32 row per image; kept as arrays until serialisation
+            return list(embeddings)
 
         except Exception as e:
-            logger.error(f"CRITICAL: Failed to generate SigLIP embedding: {e}")
+            logger.error(f"CRITICAL: Failed to generate SigLIP embeddings: {e}")
             raise RuntimeError(f"SigLIP embedding generation failed: {e}")
 
-    def process_product_images(self, image_urls: List[str]) -> Tuple[str, List[float]]:
+    def download_images(self, image_urls: List[str]) -> List[Optional[Image.Image]]:
+        """Download several images concurrently; results are in input order (None on failure)."""
+        return list(self.download_executor.map(self.download_image, image_urls))
+
+    def _iter_downloaded(self, image_urls: List[str]) -> Iterator[Tuple[str, Optional[Image.Image]]]:
+        """Yield (image_url, image) in order, fetching DOWNLOAD_WINDOW candidates at a time."""
+        for start in range(0, len(image_urls), DOWNLOAD_WINDOW):
+            window = image_urls[start:start + DOWNLOAD_WINDOW]
+            yield from zip(window, self.download_images(window))
+
+    def _iter_cached_or_downloaded(
+        self, image_urls: List[str]
+    ) -> Iterator[Tuple[str, Optional[np.ndarray], Optional[Image.Image]]]:
+        """Yield (image_url, cached embedding, image) in order, DOWNLOAD_WINDOW candidates at a time.
+
+        Candidates with a cached embedding are not downloaded and come back with image None.
+        """
+        for start in range(0, len(image_urls), DOWNLOAD_WINDOW):
+            window = image_urls[start:start + DOWNLOAD_WINDOW]
+            cached = [self.get_cached_embedding(image_url) for image_url in window]
+            to_download = [image_url for image_url, embedding in zip(window, cached) if embedding is None]
+            images = iter(self.download_images(to_download))
+            for image_url, embedding in zip(window, cached):
+                yield image_url, embedding, (next(images) if embedding is None else None)
+
+    def download_first_image(self, image_urls: List[str]) -> Optional[Tuple[str, Image.Image]]:
+        """Download the first available image. Returns (image_url, image)."""
+        for image_url, image in self._iter_downloaded(image_urls):
+            if image:
+                return image_url, image
+            logger.warning(f"Failed to download image: {image_url}")
+
+        return None
+
+    async def download_first_image_async(self, session: httpx.AsyncClient,
+                                         image_urls: List[str]) -> Optional[Tuple[str, Image.Image]]:
+        """Async variant of download_first_image using a shared async client."""
+        for image_url in image_urls:
+            image = await self._download_image_async(session, image_url)
+            if image:
+                return image_url, image
+            logger.warning(f"Failed to download image: {image_url}")
+
+        return None
+
+    def process_product_images(self, image_urls: List[str]) -> Tuple[str, np.ndarray]:
         """
         Process product images: download first available image and generate SigLIP embedding.
         REQUIRED - fails if no embedding can be generated.
@@ -123,17 +456,18 @@ class ImageProcessor:
         if not image_urls:
             raise RuntimeError("No image URLs provided - cannot generate embeddings")
 
-        # Try to download and process each image until successful
-        for image_url in image_urls:
-            image = self.download_image(image_url)
+        # Try each candidate in order until one works; the cache is consulted per candidate
+        # so a later image (e.g. another colourway) never wins over an earlier one
+        for image_url, embedding, image in self._iter_cached_or_downloaded(image_urls):
+            if embedding is not None:
+                return image_url, embedding
             if image:
-                # Resize image to required size for SigLIP
-                image = image.resize(IMAGE_SIZE, Image.Resampling.LANCZOS)
-
+                # Already resized to 384x384 when decoded
                 try:
                     # Generate SigLIP embedding (required)
                     embedding = self.generate_embedding(image)
                     logger.info(f"Successfully generated SigLIP embedding for image: {image_url}")
+                    self.cache_embeddings([(image_url, embedding)])
                     return image_url, embedding
                 except Exception as e:
                     logger.warning(f"Failed to generate SigLIP embedding for image {image_url}: {e}")
@@ -144,16 +478,22 @@ class ImageProcessor:
         # If we get here, no images worked
         raise RuntimeError(f"CRITICAL: Failed to generate SigLIP embeddings for any of the {len(image_urls)} image URLs. Embeddings are mandatory.")
 
+    def get_cached_embedding(self, image_url: str) -> Optional[np.ndarray]:
+        """Return the cached embedding of an image URL, if any."""
+        embedding = self.cache.get(image_url)
+        if embedding is not None:
+            logger.debug(f"Embedding cache hit for image: {image_url}")
+        return embedding
+
+    def get_cached_embeddings(self, image_urls: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached embedding (or None) for each image URL, in order."""
+        return [self.get_cached_embedding(image_url) for image_url in image_urls]
+
+    def cache_embeddings(self, items: List[Tuple[str, np.ndarray]]):
+        """Store (image_url, embedding) pairs in the embedding cache."""
+        # URLs are unique already and SQLite indexes the TEXT key itself, so no hashing
+        self.cache.set_many(items)
+
     def create_compressed_image_url(self, image_url: str) -> str:
         """Create a compressed version URL (if Footshop provides one)."""
-        # Footshop might have different image sizes, try to create a compressed version
-        # This is a simple approach - in practice, you'd need to check what sizes are available
-        if 'static.ftshp.digital' in image_url:
-            # Replace full_product with a smaller size if available
-            compressed_url = image_url.replace('full_product', 'medium_product')
-            return compressed_url
-        return image_url
-
-    def generate_image_hash(self, image_url: str) -> str:
-        """Generate a hash for the image URL for caching purposes."""
-        return hashlib.md5(image_url.encode()).hexdigest()
+        return compress_ftshp_url(image_url)
@@ -1,53 +1,74 @@
 import requests
-import json
+import orjson
 import re
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser, Node
 from typing import Dict, Any, Optional, List
-from config import REQUEST_TIMEOUT, BASE_URL
-from scraper.utils import retry_on_failure, RateLimiter, sanitize_string
+from config import REQUEST_TIMEOUT, BASE_URL, RATE_LIMIT_DELAY
+from scraper.utils import retry_on_failure, RateLimiter, sanitize_string, get_page_session, RETRYABLE_EXCEPTIONS
 import logging
 
 logger = logging.getLogger(__name__)
 
+PRODUCT_SCRIPT_SELECTOR = 'script[type="application/json"][data-hypernova-key="ProductDetail"]'
+DESCRIPTION_SELECTOR = 'div[data-testid="product-description"]'
+# Class names carry a build hash suffix, hence the attribute-contains match
+BREADCRUMBS_SELECTOR = 'ul[class*="Breadcrumbs_breadcrumbs"]'
+# Gender segment of a product URL: /mens-, /men-s-, /womens-, /women-s- or /unisex-
+_GENDER_RE = re.compile(r'/(?:(men|women)-?s|(unisex))-', re.IGNORECASE)
+
 class ProductScraper:
     """Scrapes individual product pages to extract product data."""
 
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.session = get_page_session()
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (compatible; ProductScraper/1.0)',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        })
-        self.rate_limiter = RateLimiter(requests_per_second=1.0)
+        }
+        # Throttle product page requests to Footshop
+        self.rate_limiter = RateLimiter(requests_per_second=1.0 / RATE_LIMIT_DELAY)
 
-    @retry_on_failure(max_attempts=3)
     def scrape_product(self, url: str) -> Optional[Dict[str, Any]]:
-        """Scrape a single product page and extract product data."""
+        """Scrape a single product page and extract product data; None if it cannot be scraped."""
+        try:
+            return self._scrape_product(url)
+        except RETRYABLE_EXCEPTIONS as e:
+            logger.error(f"Request failed for {url}: {e}")
+            return None
+
+    @retry_on_failure(max_attempts=3)
+    def _scrape_product(self, url: str) -> Optional[Dict[str, Any]]:
+        """Scrape a product page; transient request errors propagate so they are retried."""
         try:
             logger.info(f"Scraping product: {url}")
             self.rate_limiter.wait_if_needed_sync()
-            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+            response = self.session.get(url, headers=self.headers, timeout=REQUEST_TIMEOUT)
+            # A missing or removed product won't appear on a retry; 429 falls through to
+            # raise_for_status so retry_on_failure waits (honouring Retry-After) and tries again
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                logger.warning(f"Product page unavailable ({response.status_code}): {url}")
+                return None
             response.raise_for_status()
 
-            # Extract JSON data from script tags
-            soup = BeautifulSoup(response.content, 'html.parser')
+            # Extract JSON data from script tags (selectolax parses in C, far faster than html.parser).
+            # Bytes, not response.text: requests assumes ISO-8859-1 when the header has no charset,
+            # while selectolax sniffs <meta charset> itself
+            tree = HTMLParser(response.content)
 
             # Find the ProductDetail script tag
-            product_script = soup.find('script', {
-                'type': 'application/json',
-                'data-hypernova-key': 'ProductDetail'
-            })
+            product_script = tree.css_first(PRODUCT_SCRIPT_SELECTOR)
 
             if not product_script:
                 logger.warning(f"No product data found for URL: {url}")
                 return None
 
             # Extract and parse JSON
-            json_text = product_script.string
+            json_text = product_script.text()
             if json_text.startswith('<!--') and json_text.endswith('-->'):
                 json_text = json_text[4:-3]
 
-            data = json.loads(json_text)
+            # orjson parses the (large) hypernova payload several times faster than stdlib json
+            data = orjson.loads(json_text)
             product_data = data.get('data', {}).get('product_data', {})
 
             if not product_data:
@@ -55,7 +76,7 @@ class ProductScraper:
                 return None
 
             # Extract additional data from HTML
-            additional_data = self._extract_additional_data(soup, url)
+            additional_data = self._extract_additional_data(tree, url)
 
             # Combine data
             full_product_data = {**product_data, **additional_data}
@@ -63,43 +84,42 @@ class ProductScraper:
             logger.info(f"Successfully scraped product: {product_data.get('name', 'Unknown')}")
             return full_product_data
 
+        except RETRYABLE_EXCEPTIONS:
+            raise
         except requests.RequestException as e:
             logger.error(f"Request failed for {url}: {e}")
             return None
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"JSON parsing failed for {url}: {e}")
             return None
         except Exception as e:
             logger.error(f"Unexpected error scraping {url}: {e}")
             return None
 
-    def _extract_additional_data(self, soup: BeautifulSoup, url: str) -> Dict[str, Any]:
+    def _extract_additional_data(self, tree: HTMLParser, url: str) -> Dict[str, Any]:
         """Extract additional data from HTML that might not be in JSON."""
         additional_data = {}
 
         # Extract description if available
-        description_elem = soup.find('div', {'data-testid': 'product-description'})
+        description_elem = tree.css_first(DESCRIPTION_SELECTOR)
         if description_elem:
             # Get text content and clean it up
-            description_text = description_elem.get_text(separator='\n', strip=True)
+            description_text = description_elem.text(separator='\n', strip=True)
             additional_data['description'] = sanitize_string(description_text)
 
         # Extract breadcrumb category information
-        breadcrumbs = soup.find('ul', class_=re.compile(r'Breadcrumbs_breadcrumbs'))
+        breadcrumbs = tree.css_first(BREADCRUMBS_SELECTOR)
         if breadcrumbs:
-            breadcrumb_links = breadcrumbs.find_all('a')
+            breadcrumb_links: List[Node] = breadcrumbs.css('a')
             if len(breadcrumb_links) >= 2:
                 # Usually: Home > Category > Subcategory
-                category = breadcrumb_links[-1].get_text(strip=True)
+                category = breadcrumb_links[-1].text(strip=True)
                 additional_data['category'] = category
 
-        # Extract gender from URL or breadcrumbs
-        if '/mens-' in url.lower() or '/men-s-' in url.lower():
-            additional_data['gender'] = 'men'
-        elif '/womens-' in url.lower() or '/women-s-' in url.lower():
-            additional_data['gender'] = 'women'
-        elif '/unisex-' in url.lower():
-            additional_data['gender'] = 'unisex'
+        # Extract gender from URL in a single scan
+        gender_match = _GENDER_RE.search(url)
+        if gender_match:
+            additional_data['gender'] = (gender_match.group(1) or gender_match.group(2)).lower()
 
         # Extract country (always 'EU' for footshop.eu)
         additional_data['country'] = 'EU'
@@ -1,45 +1,78 @@
+import html
 import requests
-import xml.etree.ElementTree as ET
-from typing import List, Dict, Any
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import List, Dict, Any, Tuple
 from config import SITEMAP_URL, REQUEST_TIMEOUT
+from scraper.utils import get_page_session, retry_on_failure
 import logging
 import re
 from bs4 import BeautifulSoup
 
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
 logger = logging.getLogger(__name__)
 
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+URL_TAG = SITEMAP_NS + 'url'
+SITEMAP_TAG = SITEMAP_NS + 'sitemap'
+LOC_TAG = SITEMAP_NS + 'loc'
+# Used when lxml is unavailable; flat <loc> lists don't need a namespace-aware parser.
+# Anchored on the parent tag so page and child-sitemap entries stay apart and <image:loc> is ignored;
+# the parent may carry attributes or a namespace prefix
+_URL_LOC_RE = re.compile(rb'<(?:\w+:)?url\b[^>]*>\s*<(?:\w+:)?loc>\s*([^<]+?)\s*</(?:\w+:)?loc>')
+_SITEMAP_LOC_RE = re.compile(rb'<(?:\w+:)?sitemap\b[^>]*>\s*<(?:\w+:)?loc>\s*([^<]+?)\s*</(?:\w+:)?loc>')
+PARSE_ERRORS = (etree.XMLSyntaxError,) if etree is not None else ()
+# Failures of a single sitemap fetch: network/HTTP errors and malformed XML. Reading
+# response.raw surfaces mid-stream urllib3 errors that requests does not wrap
+FETCH_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError, *PARSE_ERRORS)
+# Child sitemaps of a sitemap index fetched in parallel
+SITEMAP_FETCH_CONCURRENCY = 8
+# Levels of nested sitemap indexes expanded below the root sitemap
+MAX_SITEMAP_DEPTH = 3
+
 class SitemapParser:
     """Parses Footshop EU sitemap to extract product URLs."""
 
     def __init__(self):
         self.sitemap_url = SITEMAP_URL
         self.base_url = "https://www.footshop.eu"
+        self.session = get_page_session()
 
     def get_product_urls(self) -> List[str]:
         """Fetch and parse sitemap to get all product URLs."""
         try:
-            logger.info(f"Fetching sitemap from {self.sitemap_url}")
-            # Use minimal headers - too many headers might look suspicious
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; ProductScraper/1.0)',
-            }
-            response = requests.get(self.sitemap_url, headers=headers, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-
-            # Parse XML
-            root = ET.fromstring(response.content)
-
-            # Extract URLs from sitemap
-            urls = []
-            for url_element in root.findall('.//{http://www.sitemaps.org/schemas/sitemap/0.9}url'):
-                loc_element = url_element.find('.//{http://www.sitemaps.org/schemas/sitemap/0.9}loc')
-                if loc_element is not None and loc_element.text:
-                    urls.append(loc_element.text)
+            urls, child_sitemaps = self._fetch_sitemap(self.sitemap_url)
+
+            # A sitemap index only lists child sitemaps; fetch them concurrently instead of one by one,
+            # a level at a time since a child may itself be an index
+            seen = {self.sitemap_url}
+            with ThreadPoolExecutor(max_workers=SITEMAP_FETCH_CONCURRENCY) as executor:
+                for depth in range(1, MAX_SITEMAP_DEPTH + 2):
+                    child_sitemaps = [url for url in dict.fromkeys(child_sitemaps) if url not in seen]
+                    if not child_sitemaps:
+                        break
+                    if depth > MAX_SITEMAP_DEPTH:
+                        logger.warning(
+                            f"Sitemap indexes nested deeper than {MAX_SITEMAP_DEPTH} levels, "
+                            f"skipping {len(child_sitemaps)} sitemaps"
+                        )
+                        break
+
+                    logger.info(f"Sitemap index lists {len(child_sitemaps)} sitemaps, fetching them")
+                    seen.update(child_sitemaps)
+                    results = list(executor.map(self._fetch_child_sitemap, child_sitemaps))
+                    urls.extend(chain.from_iterable(child_urls for child_urls, _ in results))
+                    child_sitemaps = list(chain.from_iterable(nested for _, nested in results))
 
             logger.info(f"Found {len(urls)} product URLs in sitemap")
             return urls
 
-        except (requests.RequestException, ET.ParseError) as e:
+        except FETCH_ERRORS as e:
             logger.warning(f"Primary sitemap method failed: {e}")
             logger.info("Attempting alternative URL discovery method...")
 
@@ -50,6 +83,56 @@ class SitemapParser:
                 logger.error(f"Alternative method also failed: {alt_e}")
                 raise e  # Raise original error
 
+    @retry_on_failure(max_attempts=3)
+    def _fetch_sitemap(self, sitemap_url: str) -> Tuple[List[str], List[str]]:
+        """Fetch one sitemap and return (page URLs, child sitemap URLs)."""
+        logger.info(f"Fetching sitemap from {sitemap_url}")
+        # Use minimal headers - too many headers might look suspicious
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (compatible; ProductScraper/1.0)',
+        }
+        response = self.session.get(sitemap_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+        response.raise_for_status()
+
+        return self._parse_locs(response)
+
+    def _fetch_child_sitemap(self, sitemap_url: str) -> Tuple[List[str], List[str]]:
+        """Fetch a child sitemap of an index; a failure skips that sitemap instead of the whole index."""
+        try:
+            return self._fetch_sitemap(sitemap_url)
+        except FETCH_ERRORS as e:
+            logger.warning(f"Skipping sitemap {sitemap_url}: {e}")
+            return [], []
+
+    def _parse_locs(self, response: requests.Response) -> Tuple[List[str], List[str]]:
+        """Extract <url><loc> and <sitemap><loc> texts from a streamed sitemap response."""
+        if etree is None:
+            content = response.content
+            # Entity-decoded (&amp; in query strings) to match what lxml returns
+            return (
+                [html.unescape(match.decode()) for match in _URL_LOC_RE.findall(content)],
+                [html.unescape(match.decode()) for match in _SITEMAP_LOC_RE.findall(content)],
+            )
+
+        # Let urllib3 undo gzip/deflate transfer encoding while lxml reads the raw stream
+        response.raw.decode_content = True
+
+        urls = []
+        sitemaps = []
+        # Stream-parse instead of building the whole tree; memory stays flat for huge sitemaps
+        for _, element in etree.iterparse(response.raw, events=('end',), tag=(URL_TAG, SITEMAP_TAG)):
+            loc_element = element.find(LOC_TAG)
+            if loc_element is not None and loc_element.text:
+                target = urls if element.tag == URL_TAG else sitemaps
+                target.append(loc_element.text.strip())
+
+            # Drop the finished element and any already-processed siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        return urls, sitemaps
+
     def _get_product_urls_alternative(self) -> List[str]:
         """Alternative method: use known product URLs for testing."""
         logger.info("Using fallback: known product URLs for testing")
@@ -1,10 +1,35 @@
 from supabase import create_client, Client
-from typing import List, Dict, Any, Optional
-from config import SUPABASE_URL, SUPABASE_KEY, TABLE_NAME
+import asyncio
+import gzip
+import httpx
+import numpy as np
+import orjson
+import threading
+from collections import OrderedDict, defaultdict
+from typing import List, Dict, Any, Optional, Set, Tuple
+from config import SUPABASE_URL, SUPABASE_KEY, TABLE_NAME, UPSERT_RPC, UPSERT_GZIP, REPORT_NEW_PRODUCTS
+from scraper.utils import chunk_list, clean_batch
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Unique key of the products table; upserts merge on it
+ON_CONFLICT = "source,product_url"
+# Rows per upsert request, kept well under PostgREST's request body limit
+UPSERT_CHUNK_SIZE = 500
+# Statuses where PostgREST rejected the rows themselves (bad value, conflict, body too large);
+# only these are worth bisecting to isolate the offending rows
+ROW_REJECTION_STATUSES = frozenset({400, 409, 413, 422})
+# Missing column/table/function: a schema problem every subset of rows would hit too
+SCHEMA_ERROR_CODES = frozenset({"PGRST202", "PGRST204", "PGRST205", "42703", "42P01", "42883"})
+# Upsert requests in flight at once on the async path
+UPSERT_CONCURRENCY = 10
+# product_url values per existence query; they are sent percent-encoded in the query string,
+# so this keeps the URL well under common gateway limits
+EXISTS_CHUNK_SIZE = 50
+# (source, product_url) pairs remembered as already stored, most recently used last
+KNOWN_EXISTING_SIZE = 100_000
+
 class SupabaseClient:
     """Handles Supabase database operations."""
 
@@ -34,54 +59,255 @@ class SupabaseClient:
                 raise RuntimeError(f"Cannot initialize Supabase client: {e} -> {fallback_e}")
 
         self.table_name = TABLE_NAME
+        self._use_persistent_session()
+        # PostgREST request builders are stateless (every .select/.upsert/... starts a fresh
+        # query), so one builder per table is reused instead of rebuilding it per call
+        self._tbl = self.client.table(self.table_name)
+        # Created on first async insert so it binds to the running event loop
+        self._async_client: Optional[httpx.AsyncClient] = None
+        # Rows written or seen in this process, kept only for REPORT_NEW_PRODUCTS;
+        # re-scrapes skip the existence query for them
+        self._known_existing: "OrderedDict[Tuple[Any, str], None]" = OrderedDict()
+        self._known_lock = threading.Lock()
 
-    def insert_product(self, product_data: Dict[str, Any]) -> bool:
-        """Insert a single product into the database."""
+    def _use_persistent_session(self):
+        """Swap PostgREST's HTTP client for a keep-alive HTTP/2 one so calls reuse a connection."""
         try:
-            # Check if product already exists (using unique constraint)
-            existing = self.client.table(self.table_name).select("id").eq("source", product_data.get("source")).eq("product_url", product_data.get("product_url")).execute()
+            postgrest = self.client.postgrest
+            default_session = postgrest.session
+            postgrest.session = httpx.Client(
+                base_url=default_session.base_url,
+                headers=default_session.headers,
+                timeout=default_session.timeout,
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+            )
+            default_session.close()
+        except Exception as e:
+            # Keep the library's own client; only connection reuse is lost
+            logger.warning(f"Could not configure persistent PostgREST session: {e}")
 
-            if existing.data:
-                logger.info(f"Product already exists: {product_data.get('product_url')}")
-                # Update instead of insert
-                return self.update_product(product_data)
+    def _prepare_row(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert in-memory values (numpy embeddings) into JSON-serialisable ones."""
+        embedding = product_data.get('embedding')
+        if isinstance(embedding, np.ndarray):
+            return {**product_data, 'embedding': embedding.tolist()}
+        return product_data
 
-            # Insert new product
-            result = self.client.table(self.table_name).insert(product_data).execute()
+    def _upsert_request(self, rows: List[Dict[str, Any]]) -> Tuple[str, Optional[Dict[str, str]], Dict[str, str], Any]:
+        """Build (path, params, headers, payload) for a bulk upsert, shared by the sync and async paths."""
+        headers = {"Content-Type": "application/json"}
+        if UPSERT_GZIP:
+            headers["Content-Encoding"] = "gzip"
 
-            if result.data:
-                logger.info(f"Successfully inserted product: {product_data.get('title', 'Unknown')}")
-                return True
-            else:
-                logger.error(f"Failed to insert product: {product_data.get('title', 'Unknown')}")
-                return False
+        if UPSERT_RPC:
+            # Server-side function: one cached plan, no per-row response body
+            return f"/rpc/{UPSERT_RPC}", None, headers, {"rows": rows}
+
+        headers["Prefer"] = "resolution=merge-duplicates,return=minimal"
+        return f"/{self.table_name}", {"on_conflict": ON_CONFLICT}, headers, rows
+
+    def _upsert(self, rows: List[Dict[str, Any]]):
+        """Insert or update rows in one request, merging on (source, product_url).
+
+        Posted on the PostgREST session with an orjson body rather than through the
+        query builder, whose stdlib json would box every embedding float.
+        """
+        path, params, headers, payload = self._upsert_request(rows)
+        response = self.client.postgrest.session.post(
+            path, params=params, headers=headers, content=self._encode_body(payload)
+        )
+        response.raise_for_status()
+
+    def insert_product(self, product_data: Dict[str, Any]) -> bool:
+        """Insert a single product into the database, updating it if it already exists."""
+        try:
+            # The unique constraint resolves insert vs update server-side; no existence check
+            self._upsert([product_data])
+            self._remember_rows([product_data])
+            logger.info(f"Successfully upserted product: {product_data.get('title', 'Unknown')}")
+            return True
 
         except Exception as e:
             logger.error(f"Error inserting product: {e}")
             return False
 
-    def insert_products_batch(self, products_data: List[Dict[str, Any]]) -> int:
-        """Insert multiple products into the database."""
-        successful_inserts = 0
+    def exists_bulk(self, source: str, urls: List[str]) -> Set[str]:
+        """Return the subset of product URLs already stored for a source, with one query per chunk."""
+        existing = set()
+        for chunk in chunk_list(urls, EXISTS_CHUNK_SIZE):
+            result = self._tbl\
+                .select("product_url")\
+                .eq("source", source)\
+                .in_("product_url", chunk)\
+                .execute()
+            existing.update(row["product_url"] for row in result.data)
+        return existing
+
+    def _remember_existing(self, keys: List[Tuple[Any, str]]):
+        """Record (source, product_url) pairs as stored, evicting the least recently used."""
+        with self._known_lock:
+            for key in keys:
+                self._known_existing[key] = None
+                self._known_existing.move_to_end(key)
+            while len(self._known_existing) > KNOWN_EXISTING_SIZE:
+                self._known_existing.popitem(last=False)
+
+    def _remember_rows(self, rows: List[Dict[str, Any]]):
+        """Record successfully upserted rows as stored; only tracked for REPORT_NEW_PRODUCTS."""
+        if not REPORT_NEW_PRODUCTS:
+            return
+        self._remember_existing([(row.get("source"), row["product_url"]) for row in rows if row.get("product_url")])
+
+    def _count_existing(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """Count rows that will update an existing product.
+
+        Returns None unless REPORT_NEW_PRODUCTS is set, or if the check fails; the
+        upsert itself never needs it.
+        """
+        if not REPORT_NEW_PRODUCTS:
+            return None
+
+        known = 0
+        urls_by_source = defaultdict(list)
+        with self._known_lock:
+            for row in rows:
+                if not row.get("product_url"):
+                    continue
+                key = (row.get("source"), row["product_url"])
+                if key in self._known_existing:
+                    self._known_existing.move_to_end(key)
+                    known += 1
+                else:
+                    urls_by_source[key[0]].append(key[1])
+
+        try:
+            existing = 0
+            for source, urls in urls_by_source.items():
+                found = self.exists_bulk(source, urls)
+                self._remember_existing([(source, url) for url in found])
+                existing += len(found)
+            return known + existing
+        except Exception as e:
+            logger.warning(f"Could not check for existing products: {e}")
+            return None
+
+    def _log_batch_result(self, successful_inserts: int, total: int, existing: Optional[int]):
+        """Log the outcome of a batch upsert, split into new and updated products when known."""
+        if existing is None:
+            logger.info(f"Batch insert completed: {successful_inserts}/{total} products inserted")
+        else:
+            logger.info(
+                f"Batch insert completed: {successful_inserts}/{total} products inserted "
+                f"({total - existing} new, {existing} updated)"
+            )
+
+    @staticmethod
+    def _is_row_rejection(error: httpx.HTTPStatusError) -> bool:
+        """Whether a failed upsert was caused by the rows sent rather than auth, schema or server trouble."""
+        response = error.response
+        if response.status_code not in ROW_REJECTION_STATUSES:
+            return False
+        try:
+            body = response.json()
+        except ValueError:
+            return True
+        return not (isinstance(body, dict) and body.get("code") in SCHEMA_ERROR_CODES)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Return the HTTP/2 PostgREST client used by the async insert path."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                base_url=f"{SUPABASE_URL}/rest/v1",
+                headers={
+                    "apikey": SUPABASE_KEY,
+                    "Authorization": f"Bearer {SUPABASE_KEY}",
+                },
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20),
+                timeout=60.0,
+            )
+        return self._async_client
+
+    @staticmethod
+    def _encode_body(payload: Any) -> bytes:
+        """Serialise a request body with orjson, gzipped when UPSERT_GZIP is set."""
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+        if UPSERT_GZIP:
+            # Repeated keys and URL prefixes compress several-fold
+            body = gzip.compress(body, compresslevel=5)
+        return body
+
+    async def _upsert_async(self, client: httpx.AsyncClient, rows: List[Dict[str, Any]]):
+        """Async equivalent of _upsert."""
+        path, params, headers, payload = self._upsert_request(rows)
+
+        # Encoding a few MB of rows (and compressing it) would otherwise block the event loop
+        body = await asyncio.to_thread(self._encode_body, payload)
+        response = await client.post(path, params=params, headers=headers, content=body)
+        response.raise_for_status()
+
+    async def _upsert_or_split_async(self, client: httpx.AsyncClient, rows: List[Dict[str, Any]]) -> int:
+        """Upsert rows and return how many were written.
+
+        A request whose rows were rejected is retried in halves, so one bad row only
+        loses itself instead of the whole chunk. Any other failure drops the chunk.
+        """
+        try:
+            await self._upsert_async(client, rows)
+            self._remember_rows(rows)
+            return len(rows)
+        except httpx.HTTPStatusError as e:
+            if not self._is_row_rejection(e):
+                logger.error(f"Error upserting batch of {len(rows)} products: {e}")
+                return 0
+            if len(rows) == 1:
+                logger.error(f"Error upserting product {rows[0].get('product_url')}: {e}")
+                return 0
+            logger.warning(f"Upsert of {len(rows)} products rejected, retrying in halves: {e}")
+            middle = len(rows) // 2
+            return (await self._upsert_or_split_async(client, rows[:middle])
+                    + await self._upsert_or_split_async(client, rows[middle:]))
+        except httpx.HTTPError as e:
+            logger.error(f"Error upserting batch of {len(rows)} products: {e}")
+            return 0
+
+    async def insert_products_batch_async(self, products_data: List[Dict[str, Any]]) -> int:
+        """Insert multiple products with concurrent bulk upserts, one request per chunk."""
+        client = self._get_async_client()
+        semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
 
-        for product_data in products_data:
-            if self.insert_product(product_data):
-                successful_inserts += 1
+        async def upsert_chunk(chunk: List[Dict[str, Any]]) -> int:
+            async with semaphore:
+                return await self._upsert_or_split_async(client, chunk)
 
-        logger.info(f"Batch insert completed: {successful_inserts}/{len(products_data)} products inserted")
+        rows = clean_batch(products_data)
+        # Must finish before the upserts land; uses the sync client, so off the event loop
+        existing = await asyncio.to_thread(self._count_existing, rows) if REPORT_NEW_PRODUCTS else None
+        results = await asyncio.gather(*(upsert_chunk(chunk) for chunk in chunk_list(rows, UPSERT_CHUNK_SIZE)))
+        successful_inserts = sum(results)
+
+        self._log_batch_result(successful_inserts, len(products_data), existing)
         return successful_inserts
 
+    async def aclose(self):
+        """Close the async HTTP client, if one was created."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
     def update_product(self, product_data: Dict[str, Any]) -> bool:
         """Update an existing product."""
+        product_data = self._prepare_row(product_data)
         try:
-            # Update based on source and product_url
-            result = self.client.table(self.table_name)\
-                .update(product_data)\
+            # Update based on source and product_url; only the affected-row count comes back
+            result = self._tbl\
+                .update(product_data, count="exact", returning="minimal")\
                 .eq("source", product_data.get("source"))\
                 .eq("product_url", product_data.get("product_url"))\
                 .execute()
 
-            if result.data:
+            if result.count:
                 logger.info(f"Successfully updated product: {product_data.get('title', 'Unknown')}")
                 return True
             else:
@@ -95,7 +321,8 @@ class SupabaseClient:
     def get_product_count(self) -> int:
         """Get total count of products in database."""
         try:
-            result = self.client.table(self.table_name).select("id", count="exact").execute()
+            # HEAD request: the count comes back in Content-Range with no rows in the body
+            result = self._tbl.select("id", count="exact", head=True).execute()
             return result.count
         except Exception as e:
             logger.error(f"Error getting product count: {e}")
@@ -104,7 +331,7 @@ class SupabaseClient:
     def get_products_by_source(self, source: str, limit: int = 100) -> List[Dict[str, Any]]:
         """Get products by source."""
         try:
-            result = self.client.table(self.table_name)\
+            result = self._tbl\
                 .select("*")\
                 .eq("source", source)\
                 .limit(limit)\
@@ -117,13 +344,16 @@ class SupabaseClient:
     def delete_product(self, source: str, product_url: str) -> bool:
         """Delete a product by source and product_url."""
         try:
-            result = self.client.table(self.table_name)\
-                .delete()\
+            result = self._tbl\
+                .delete(count="exact", returning="minimal")\
                 .eq("source", source)\
                 .eq("product_url", product_url)\
                 .execute()
 
-            if result.data:
+            if result.count:
+                if REPORT_NEW_PRODUCTS:
+                    with self._known_lock:
+                        self._known_existing.pop((source, product_url), None)
                 logger.info(f"Successfully deleted product: {product_url}")
                 return True
             else:
@@ -133,3 +363,60 @@ class SupabaseClient:
         except Exception as e:
             logger.error(f"Error deleting product: {e}")
             return False
+
+class BatchedUpserter:
+    """Collects rows pushed one at a time and upserts them in bulk.
+
+    A batch is flushed once `limit` rows are waiting or `window` seconds after its
+    first row arrived, whichever comes first. close() flushes what is left and
+    returns the number of rows written.
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, client: SupabaseClient, limit: int = UPSERT_CHUNK_SIZE, window: float = 0.5):
+        self.client = client
+        self.limit = limit
+        self.window = window
+        self.inserted = 0
+        # Bounded so push() blocks the pipeline while a slow flush is still running
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=2 * limit)
+        self._task = asyncio.create_task(self._run())
+
+    async def push(self, row: Dict[str, Any]):
+        """Queue a row for the next batch, waiting while the queue is full."""
+        await self._queue.put(row)
+
+    async def close(self) -> int:
+        """Flush remaining rows, stop the background task and return the rows written."""
+        await self._queue.put(self._CLOSE)
+        await self._task
+        return self.inserted
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            row = await self._queue.get()
+            if row is self._CLOSE:
+                break
+
+            rows = [row]
+            deadline = loop.time() + self.window
+            while len(rows) < self.limit:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is self._CLOSE:
+                    closing = True
+                    break
+                rows.append(row)
+
+            try:
+                self.inserted += await self.client.insert_products_batch_async(rows)
+            except Exception as e:
+                logger.error(f"Error flushing batch of {len(rows)} products: {e}")
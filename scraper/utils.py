@@ -1,41 +1,133 @@
 import asyncio
 import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
-from typing import Any, Callable, Optional
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import re
+import threading
 import time
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import httpx
 import requests
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+from cachecontrol import CacheControlAdapter
+from cachecontrol.caches.file_cache import FileCache
+from config import HTTP_CACHE_PATH
 
 logger = logging.getLogger(__name__)
 
+# Footshop CDN image URL; the size segment follows the host
+_COMPRESS_RE = re.compile(r'(static\.ftshp\.digital.*?)full_product')
+
+# Null bytes dropped, line breaks flattened to spaces - one pass in sanitize_string
+_SANITIZE_TABLE = str.maketrans({'\x00': None, '\r': ' ', '\n': ' '})
+
+_page_session: Optional[requests.Session] = None
+
+def get_page_session() -> requests.Session:
+    """Return the pooled session for sitemap and product-page requests, backed by an HTTP cache.
+
+    Responses are stored on disk under HTTP_CACHE_PATH; on later runs unchanged pages are
+    revalidated with ETag/Last-Modified and served from the cache on a 304. Images go
+    through ImageProcessor's own HTTP/2 client, and their embeddings are cached separately.
+    Connections are pooled and kept alive; headers are passed per request.
+    """
+    global _page_session
+    if _page_session is None:
+        # urllib3 (and httpx) only advertise and decode br when a Brotli package is importable
+        if 'br' not in ACCEPT_ENCODING:
+            logger.warning("Brotli is not installed; responses will use gzip (install 'brotli')")
+
+        session = requests.Session()
+        adapter = CacheControlAdapter(
+            cache=FileCache(HTTP_CACHE_PATH),
+            pool_connections=16,
+            pool_maxsize=64,
+            # Connection-level retries only; 429/5xx responses are retried once, by
+            # retry_on_failure, rather than by both layers multiplied together
+            max_retries=Retry(total=3, backoff_factor=0.3, respect_retry_after_header=False),
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _page_session = session
+    return _page_session
+
+# Transient network failures only; programming errors (KeyError, AttributeError, ...) fail fast
+RETRYABLE_EXCEPTIONS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.HTTPError,
+    httpx.TransportError,
+    httpx.HTTPStatusError,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+# Longest Retry-After a retry will wait for
+MAX_RETRY_AFTER = 60.0
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Seconds requested by a Retry-After header on the error's response, if any."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+def _retry_delay(backoff_factor: float, attempt: int, error: BaseException) -> float:
+    """Exponential backoff of backoff_factor * 2 ** (attempt - 1) seconds, or longer if the server asked."""
+    delay = backoff_factor * 2 ** (attempt - 1)
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+    return delay
+
 def retry_on_failure(max_attempts: int = 3, backoff_factor: float = 2.0):
-    """Decorator for retrying functions on failure."""
+    """Decorator for retrying functions on failure.
+
+    A plain loop, so a call that succeeds on the first attempt costs a single
+    try/except. After the last attempt the original exception is re-raised.
+    """
     def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        @retry(
-            stop=stop_after_attempt(max_attempts),
-            wait=wait_exponential(multiplier=backoff_factor),
-            retry=retry_if_exception_type((requests.RequestException, Exception)),
-            before_sleep=lambda retry_state: logger.warning(
-                f"Retrying {func.__name__} in {retry_state.next_action.sleep} seconds "
-                f"(attempt {retry_state.attempt_number}/{max_attempts})"
+        def log_retry(attempt: int, delay: float, error: BaseException):
+            logger.warning(
+                f"Retrying {func.__name__} in {delay} seconds after {type(error).__name__}: {error} "
+                f"(attempt {attempt}/{max_attempts})"
             )
-        )
+
+        @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            return await func(*args, **kwargs)
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except RETRYABLE_EXCEPTIONS as e:
+                    if attempt == max_attempts:
+                        raise
+                    delay = _retry_delay(backoff_factor, attempt, e)
+                    log_retry(attempt, delay, e)
+                    await asyncio.sleep(delay)
 
         @wraps(func)
-        @retry(
-            stop=stop_after_attempt(max_attempts),
-            wait=wait_exponential(multiplier=backoff_factor),
-            retry=retry_if_exception_type((requests.RequestException, Exception)),
-            before_sleep=lambda retry_state: logger.warning(
-                f"Retrying {func.__name__} in {retry_state.next_action.sleep} seconds "
-                f"(attempt {retry_state.attempt_number}/{max_attempts})"
-            )
-        )
         def sync_wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return func(*args, **kwargs)
+                except RETRYABLE_EXCEPTIONS as e:
+                    if attempt == max_attempts:
+                        raise
+                    delay = _retry_delay(backoff_factor, attempt, e)
+                    log_retry(attempt, delay, e)
+                    time.sleep(delay)
 
         if asyncio.iscoroutinefunction(func):
             return async_wrapper
@@ -45,35 +137,44 @@ def retry_on_failure(max_attempts: int = 3, backoff_factor: float = 2.0):
     return decorator
 
 class RateLimiter:
-    """Simple rate limiter to prevent overwhelming servers."""
+    """Token-bucket rate limiter, safe to share between threads and coroutines.
 
-    def __init__(self, requests_per_second: float = 1.0):
+    Each call reserves a token under a lock and then sleeps outside it until the
+    token is due, so concurrent callers are spaced out instead of racing on a
+    shared timestamp. `burst` tokens may be spent back to back after idle time.
+    """
+
+    def __init__(self, requests_per_second: float = 1.0, burst: int = 1):
         self.requests_per_second = requests_per_second
-        self.last_request_time = 0
-        self.min_interval = 1.0 / requests_per_second
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.requests_per_second)
+            self.updated = now
+            # Going negative queues the caller behind earlier reservations
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.requests_per_second
 
     async def wait_if_needed(self):
         """Wait if necessary to maintain rate limit."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-
-        if time_since_last < self.min_interval:
-            wait_time = self.min_interval - time_since_last
+        wait_time = self._reserve()
+        if wait_time > 0:
             await asyncio.sleep(wait_time)
 
-        self.last_request_time = time.time()
-
     def wait_if_needed_sync(self):
         """Synchronous version of wait_if_needed."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-
-        if time_since_last < self.min_interval:
-            wait_time = self.min_interval - time_since_last
+        wait_time = self._reserve()
+        if wait_time > 0:
             time.sleep(wait_time)
 
-        self.last_request_time = time.time()
-
 def validate_product_data(data: dict) -> bool:
     """Validate that product data has required fields."""
     required_fields = ['id', 'title', 'image_url']
@@ -90,11 +191,8 @@ def sanitize_string(text: str, max_length: Optional[int] = None) -> str:
     if not text:
         return ""
 
-    # Remove null bytes and other problematic characters
-    sanitized = text.replace('\x00', '').replace('\r', ' ').replace('\n', ' ')
-
-    # Strip whitespace
-    sanitized = sanitized.strip()
+    # Remove null bytes and other problematic characters, then strip whitespace
+    sanitized = text.translate(_SANITIZE_TABLE).strip()
 
     # Truncate if too long
     if max_length and len(sanitized) > max_length:
@@ -102,7 +200,59 @@ def sanitize_string(text: str, max_length: Optional[int] = None) -> str:
 
     return sanitized
 
-def chunk_list(lst: list, chunk_size: int):
-    """Split a list into chunks of specified size."""
-    for i in range(0, len(lst), chunk_size):
-        yield lst[i:i + chunk_size]
+# Free-text columns cleaned by clean_batch
+_TEXT_FIELDS = ('title', 'brand', 'category', 'description')
+
+def clean_batch(rows: Iterable[Dict[str, Any]], required: Tuple[str, ...] = ('id', 'title', 'image_url'),
+                max_title: int = 512) -> List[Dict[str, Any]]:
+    """Validate and sanitize mapped rows in a single pass before a bulk write.
+
+    Rows missing a required field are dropped, so one bad product cannot fail a whole
+    upsert request; text fields are sanitized and titles truncated to max_title.
+    Postgres rejects an upsert that touches the same row twice, so duplicates on
+    (source, product_url) and on id are collapsed, keeping the last row.
+    """
+    by_key: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+    for row in rows:
+        missing = [field for field in required if not row.get(field)]
+        if missing:
+            logger.warning(f"Skipping product {row.get('product_url')}: missing {', '.join(missing)}")
+            continue
+
+        row = dict(row)
+        for field in _TEXT_FIELDS:
+            value = row.get(field)
+            if isinstance(value, str):
+                row[field] = value.translate(_SANITIZE_TABLE).strip()
+        if len(row['title']) > max_title:
+            row['title'] = row['title'][:max_title - 3] + "..."
+
+        key = (row.get('source'), row.get('product_url'))
+        if key in by_key:
+            logger.warning(f"Duplicate product {key[1]} in batch, keeping the last row")
+        by_key[key] = row
+
+    by_id: Dict[Any, Dict[str, Any]] = {}
+    for row in by_key.values():
+        previous = by_id.get(row['id'])
+        if previous is not None:
+            logger.warning(
+                f"Products {previous.get('product_url')} and {row.get('product_url')} share id {row['id']}, "
+                f"keeping the last row"
+            )
+        by_id[row['id']] = row
+
+    return list(by_id.values())
+
+def compress_ftshp_url(image_url: Optional[str]) -> Optional[str]:
+    """Return the medium-size variant of a Footshop CDN image URL."""
+    if not image_url:
+        return None
+
+    return _COMPRESS_RE.sub(r'\1medium_product', image_url)
+
+def chunk_list(items: Iterable, chunk_size: int) -> Iterator[list]:
+    """Split any iterable into lists of at most chunk_size items, lazily."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
@@ -69,7 +69,7 @@ async def test_image_processor():
 
             # Test embedding generation
             embedding = processor.generate_embedding(image)
-            if embedding:
+            if embedding is not None:
                 print("✓ Embedding generation successful")
                 print(f"  Embedding dimension: {len(embedding)}")
                 return embedding
@@ -111,49 +111,82 @@ async def test_data_mapper():
         print(f"✗ Data mapper failed: {e}")
         return None
 
-async def test_full_pipeline():
-    """Test the complete pipeline with one product."""
+async def test_full_pipeline(limit: int = 3):
+    """Test the complete pipeline on a few products, with scrape and embed stages overlapped."""
     print("\nTesting Full Pipeline...")
 
     try:
-        # Get one product URL
+        # Get a few product URLs
         parser = SitemapParser()
-        urls = parser.get_product_urls_paginated(limit=1)
+        urls = parser.get_product_urls_paginated(limit=limit)
 
         if not urls:
             print("✗ No product URLs found")
             return
 
-        url = urls[0]
-        print(f"Testing with URL: {url}")
+        print(f"Testing with {len(urls)} URLs")
 
-        # Scrape product
         scraper = ProductScraper()
-        raw_product = scraper.scrape_product(url)
-
-        if not raw_product:
-            print("✗ Product scraping failed")
-            return
-
-        print("✓ Product scraped successfully")
-
-        # Process images
         processor = ImageProcessor()
-        image_urls = [raw_product.get('image')] if raw_product.get('image') else []
-        image_url, embedding = processor.process_product_images(image_urls)
-
-        print(f"✓ Image processing completed (embedding: {'✓' if embedding else '✗'})")
-
-        # Map data
         mapper = DataMapper()
-        mapped_product = mapper.map_product_data(raw_product, image_url, embedding)
+        loop = asyncio.get_running_loop()
+
+        # Stages connected by a bounded queue: while one product's image downloads,
+        # the next product pages are already being scraped
+        url_queue: asyncio.Queue = asyncio.Queue()
+        scraped_queue: asyncio.Queue = asyncio.Queue(maxsize=8)
+        for url in urls:
+            url_queue.put_nowait(url)
+        downloaded = []
+        mapped_products = []
+
+        async def scrape_worker():
+            while not url_queue.empty():
+                url = url_queue.get_nowait()
+                raw_product = await loop.run_in_executor(None, scraper.scrape_product, url)
+                if raw_product:
+                    print(f"✓ Product scraped successfully: {url}")
+                    await scraped_queue.put(raw_product)
+                else:
+                    print(f"✗ Product scraping failed: {url}")
+
+        async def scrape_stage():
+            await asyncio.gather(*(scrape_worker() for _ in range(4)))
+            await scraped_queue.put(None)
+
+        async def download_stage():
+            while (raw_product := await scraped_queue.get()) is not None:
+                # Download images as products arrive; embedding happens once for the whole set
+                image_urls = [raw_product.get('image')] if raw_product.get('image') else []
+                result = await loop.run_in_executor(None, processor.download_first_image, image_urls)
+                if result:
+                    image_url, image = result
+                    downloaded.append((raw_product, image_url, image))
+                else:
+                    print(f"✗ Image download failed for: {raw_product.get('name', 'Unknown')}")
+
+        await asyncio.gather(scrape_stage(), download_stage())
+
+        if downloaded:
+            # One batched SigLIP forward for all products (half precision on GPU)
+            embeddings = await processor.generate_embeddings_batch_async([image for _, _, image in downloaded])
+            print(f"✓ Image processing completed ({len(embeddings)} embeddings in one batch)")
+
+            # Map data
+            for (raw_product, image_url, _), embedding in zip(downloaded, embeddings):
+                mapped_products.append(mapper.map_product_data(raw_product, image_url, embedding))
+
+        if not mapped_products:
+            print("✗ No products made it through the pipeline")
+            return None
 
-        print("✓ Data mapping completed")
-        print(f"  Final product ID: {mapped_product.get('id')}")
-        print(f"  Has embedding: {mapped_product.get('embedding') is not None}")
+        print(f"✓ Data mapping completed for {len(mapped_products)} products")
+        for mapped_product in mapped_products:
+            print(f"  Final product ID: {mapped_product.get('id')}")
+            print(f"  Has embedding: {mapped_product.get('embedding') is not None}")
 
         print("✓ Full pipeline test completed successfully")
-        return mapped_product
+        return mapped_products
 
     except Exception as e:
         print(f"✗ Full pipeline test failed: {e}")